@@ -1,8 +1,21 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+from urllib3.util.retry import Retry
 import os
+import re
 import time
+import hashlib
+import pickle
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from functools import lru_cache
 from dotenv import load_dotenv
-import json  # We need this for GraphQL
+import orjson  # Faster JSON encoding/decoding for the GraphQL requests
+import ijson
+import numpy as np
 
 # Load environment variables from .env file
 load_dotenv()
@@ -14,250 +27,918 @@ LOCATION_ID = os.getenv("LOCATION_ID")
 POS_BASE_URL = os.getenv("POS_BASE_URL")
 POS_PASSWORD = os.getenv("POS_PASSWORD")
 
+# Built once here instead of on every request
+SHOPIFY_API_URL = f"https://{SHOPIFY_STORE}/admin/api/2024-07"
+SHOPIFY_GQL_URL = f"{SHOPIFY_API_URL}/graphql.json"
+SHOPIFY_HEADERS = {"X-Shopify-Access-Token": SHOPIFY_TOKEN}
+SHOPIFY_GQL_HEADERS = {**SHOPIFY_HEADERS, "Content-Type": "application/json"}
+LOCATION_GID = f"gid://shopify/Location/{LOCATION_ID}"
+# Where the last POS download is kept so unchanged inventory is not downloaded again
+POS_CACHE_FILE = os.getenv("POS_CACHE_FILE", os.path.join("cache", "pos_inventory.pickle"))
+# Bump when the cached inventory layout changes, so old cache files are ignored
+POS_CACHE_VERSION = 3
+# Shopify SKUs/ids can be remembered between runs for this many hours (0 = always fetch, the default).
+# Quantities are not cached, so turning this on also turns off the unchanged-stock skip:
+# every run that uses the cache sends a stock update for every matched SKU.
+SKU_CACHE_FILE = os.getenv("SKU_CACHE_FILE", os.path.join("cache", "shopify_skus.sqlite3"))
+SKU_CACHE_HOURS = float(os.getenv("SKU_CACHE_HOURS", "0"))
+# Bump when the SKU cache tables change, so old cache files are recreated
+SKU_CACHE_VERSION = 2
+
+# How often (in seconds) to ask Shopify whether the bulk SKU export is ready
+BULK_POLL_SECONDS = 3
+# How many updates are sent to Shopify in a single GraphQL request
+BATCH_SIZE = 100
+# How many variants are looked up in one nodes(ids:) query (Shopify allows at most 250)
+NODES_PER_REQUEST = 250
+# How many products may share one price mutation document: every aliased
+# productVariantsBulkUpdate costs ~10+ points and a request may not exceed 1000
+PRICE_PRODUCTS_PER_REQUEST = 20
+# How many requests may be in flight to Shopify at the same time
+# (2 is safe for standard plans, Shopify Plus stores can go up to 20)
+SHOPIFY_CONCURRENCY = int(os.getenv("SHOPIFY_CONCURRENCY", "2"))
+
+# One pooled session for every request so TCP/TLS connections are kept alive
+# and reused instead of being opened again for each call.
+# The Shopify token is sent per request, never on the session, so it does not leak to the POS.
+SESSION = requests.Session()
+ADAPTER = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        # Retry POSTs too: the stock/price mutations only *set* values, so repeating them is harmless.
+        # A repeated bulkOperationRunQuery is refused as "already in progress"; get_shopify_skus_bulk
+        # handles that by following the export the first attempt started.
+        allowed_methods=None
+    )
+)
+SESSION.mount("https://", ADAPTER)
+SESSION.mount("http://", ADAPTER)  # The POS may be served over plain HTTP on the local network
+
 
 # ==== HELPER FUNCTIONS ====
+class NonPrintableTable(dict):
+    """
+    str.translate table that deletes every character str.isprintable() rejects.
+    Code points are checked the first time they are seen and remembered, so the
+    table only ever holds the characters that actually appear in SKUs.
+    """
+
+    def __missing__(self, codepoint):
+        self[codepoint] = codepoint if chr(codepoint).isprintable() else None
+        return self[codepoint]
+
+
+NON_PRINTABLE = NonPrintableTable()
+
+
 def sanitize_sku(sku):
     """Removes non-printable characters from a SKU string."""
     if not isinstance(sku, str):
         return ""
-    return "".join(char for char in sku if char.isprintable())
+    return sku.translate(NON_PRINTABLE)
 
 
-def round_to_5_or_10(price):
+def round_to_5_or_10(prices):
     """
-    Round price UP to the nearest 5 or 10 Egyptian Pounds.
-    Returns an integer price in pounds.
+    Round prices UP to the nearest 5 or 10 Egyptian Pounds.
+    Works on a whole NumPy array at once (or a single number).
+    Returns integer prices in pounds.
     """
-    # Convert to Egyptian pounds and round up to nearest integer
-    price_pounds = int(price)  # Assuming price is already in pounds
-    
-    # Check if price already ends with 0 or 5
-    last_digit = price_pounds % 10
-    if last_digit == 0 or last_digit == 5:
-        return price_pounds
-    
-    # Round up to nearest 5 or 10
-    remainder = price_pounds % 10
-    
-    if remainder < 5:
-        price_pounds = price_pounds - remainder + 5
-    else:
-        price_pounds = price_pounds - remainder + 10
-    
-    return price_pounds
+    # Convert to Egyptian pounds (drop the piastres)
+    price_pounds = np.trunc(prices).astype(np.int64)
+
+    # Prices already ending with 0 or 5 stay as they are,
+    # everything else goes up to the next 5 or 10
+    return price_pounds + (-price_pounds) % 5
+
+
+def parse_price_cents(value):
+    """Parse a price (e.g. "150.00") to integer cents; -1 if it is missing or malformed."""
+    try:
+        return round(float(value) * 100)
+    except (ValueError, TypeError, OverflowError):
+        return -1
+
+
+def error_index(field, position):
+    """
+    Returns the list index a GraphQL userError points at, or None.
+    e.g. field ["input", "setQuantities", "3", "quantity"] with position 2 -> 3
+    """
+    if field and len(field) > position and str(field[position]).isdigit():
+        return int(field[position])
+    return None
+
+
+def make_sku_entry(sku, inventory_item_id, variant_id, product_id, price, compare_at_price, current_qty, stocked=True):
+    """
+    Build the dict we keep for every Shopify variant.
+    Prices are parsed to integer cents here, once; a price that can't be parsed is -1.
+    `stocked` is False when Shopify reports the item is not stocked at our location.
+    """
+    price_cents = parse_price_cents(price)
+    if price_cents < 0:
+        print(f"⚠️  Cannot parse current price for SKU {sku}: {price}. Its price will not be updated.")
+    return {
+        "sku": sku,
+        "clean_sku": sanitize_sku(sku),
+        "inventory_item_id": inventory_item_id,
+        "variant_id": variant_id,
+        "product_id": product_id,
+        "price_cents": price_cents,
+        "compare_at_cents": parse_price_cents(compare_at_price),
+        "current_qty": current_qty,
+        "stocked": stocked
+    }
+
+
+def price_decision(pos_price_cents, cur_cents, cmp_cents):
+    """
+    The pricing rule: Price = POS price + 15%, rounded up to 5 or 10 Egyptian Pounds.
+    Pure integer math that works on single values or whole NumPy arrays.
+    Returns the new price in cents, or -1 where the price should be left alone:
+    1. The current price is unknown (-1)
+    2. Product has a discount (compare_at_price is greater than current_price)
+    3. The price is already at (or above) POS price + 15%
+    """
+    # Calculate the target price (POS price + 15%, to the nearest cent), then
+    # drop the piastres and round to nearest 5 or 10 Egyptian Pounds
+    target_cents = round_to_5_or_10(((pos_price_cents * 115 + 50) // 100) // 100) * 100
+
+    # A product has a discount if compare_at_price exists and is greater than current_price
+    # (a missing compare_at_price is -1, so it never counts as a discount)
+    has_discount = cmp_cents > cur_cents
+    leave_alone = (cur_cents < 0) | has_discount | (cur_cents >= target_cents)
+    return np.where(leave_alone, -1, target_cents)
+
+
+def get_price_updates(matched, pos_price_cents):
+    """
+    Run price_decision for all matched SKUs in one NumPy pass.
+    `matched` is the list of matched Shopify items, `pos_price_cents` their POS prices
+    in integer cents (same order).
+    Returns price-update entries only for SKUs whose price should change.
+    """
+    if not matched:
+        return []
+
+    cur_cents = np.fromiter((item["price_cents"] for item in matched), dtype=np.int64, count=len(matched))
+    cmp_cents = np.fromiter((item["compare_at_cents"] for item in matched), dtype=np.int64, count=len(matched))
+    target_cents = price_decision(pos_price_cents, cur_cents, cmp_cents)
+
+    updates = []
+    for i in np.flatnonzero(target_cents >= 0):
+        item = matched[i]
+        updates.append({
+            "sku": item["sku"],
+            "product_id": item["product_id"],
+            "variant_id": item["variant_id"],
+            "price": int(target_cents[i]) // 100,
+            "current_price": f"{cur_cents[i] / 100:.2f}",
+            "pos_price": pos_price_cents[i] / 100
+        })
+    return updates
 
 
 # ==== API FUNCTIONS ====
-def get_shopify_skus():
-    """Get all products with SKUs, prices, and compare_at_prices from Shopify using cursor-based pagination."""
-    skus = []
-    url = f"https://{SHOPIFY_STORE}/admin/api/2024-07/products.json?limit=250"
-    headers = {"X-Shopify-Access-Token": SHOPIFY_TOKEN}
+class ShopifyBucket:
+    """
+    Shopify's leaky-bucket rate limit, as last reported by Shopify itself.
+    Requests only wait when the bucket is (almost) full instead of sleeping blindly.
+    """
+
+    def __init__(self, capacity, leak_rate):
+        self.used = 0
+        self.capacity = capacity
+        self.leak_rate = leak_rate  # How much of the bucket drains per second
+        self.lock = threading.Lock()
 
-    while url:
+    def wait(self, cost=0):
+        """
+        Sleep before a request if the bucket is 90% full or more, until it is half empty.
+        `cost` is what the request is known to need (after a THROTTLED response):
+        then sleep only until that many points are free.
+        """
+        with self.lock:
+            if self.used < 0.9 * self.capacity and self.used + cost <= self.capacity:
+                return
+            target = max(0, self.capacity - cost) if cost else 0.5 * self.capacity
+            delay = (self.used - target) / self.leak_rate
+            # It will have drained by the time we wake up, so other threads don't sleep again
+            self.used = target
+        time.sleep(delay)
+
+    def update_from_headers(self, resp):
+        """REST responses carry "X-Shopify-Shop-Api-Call-Limit: used/capacity"."""
+        call_limit = resp.headers.get("X-Shopify-Shop-Api-Call-Limit")
+        if not call_limit:
+            return
         try:
-            resp = requests.get(url, headers=headers)
-            resp.raise_for_status()
-            products = resp.json().get("products", [])
-            for product in products:
-                for variant in product["variants"]:
-                    if variant.get("sku") and variant.get("inventory_item_id"):
-                        skus.append({
-                            "sku": variant["sku"],
-                            "inventory_item_id": variant["inventory_item_id"],
-                            "variant_id": variant["id"],
-                            "current_price": variant.get("price", "0.0"),
-                            "compare_at_price": variant.get("compare_at_price")
-                        })
-
-            link_header = resp.headers.get("Link")
-            if link_header and 'rel="next"' in link_header:
-                parts = link_header.split(",")
-                next_link_info = [p for p in parts if 'rel="next"' in p]
-                if next_link_info:
-                    url = next_link_info[0].split(';')[0].strip('<> ')
-                else:
-                    url = None
-            else:
-                url = None
-        except requests.exceptions.RequestException as e:
-            print(f"❌ Error fetching products from Shopify: {e}")
+            used, capacity = (int(part) for part in call_limit.split("/"))
+        except ValueError:
+            return
+        with self.lock:
+            self.used, self.capacity = used, capacity
+
+    def update_from_graphql(self, response_data):
+        """GraphQL responses report the bucket in extensions.cost.throttleStatus."""
+        throttle = (((response_data or {}).get("extensions") or {}).get("cost") or {}).get("throttleStatus")
+        if not throttle or not throttle.get("maximumAvailable"):
+            return
+        with self.lock:
+            self.capacity = throttle["maximumAvailable"]
+            self.used = self.capacity - throttle.get("currentlyAvailable", 0)
+            self.leak_rate = throttle.get("restoreRate") or self.leak_rate
+
+
+# REST allows 40 requests draining at 2/s, GraphQL 1000 cost points restoring at 50/s
+# (Plus stores get more, the real numbers are picked up from the first response)
+REST_BUCKET = ShopifyBucket(capacity=40, leak_rate=2)
+GRAPHQL_BUCKET = ShopifyBucket(capacity=1000, leak_rate=50)
+
+
+def shopify_request(method, url, bucket, cost=0, **kwargs):
+    """
+    Send one request to the Shopify Admin API, first waiting if `bucket` is nearly full
+    (or has less than `cost` points free).
+    `headers` defaults to SHOPIFY_HEADERS and must include the access token.
+    Raises requests.exceptions.RequestException on HTTP errors.
+    """
+    kwargs.setdefault("headers", SHOPIFY_HEADERS)
+
+    bucket.wait(cost)
+    resp = SESSION.request(method, url, **kwargs)
+    resp.raise_for_status()
+    bucket.update_from_headers(resp)
+    return resp
+
+
+def parse_shopify_json(resp):
+    """
+    Decode a Shopify response body.
+    A body that isn't JSON (e.g. an HTML error page sent with status 200) raises
+    requests.exceptions.InvalidJSONError, so callers only need to catch RequestException.
+    """
+    try:
+        return orjson.loads(resp.content)
+    except ValueError as e:
+        raise requests.exceptions.InvalidJSONError(f"Shopify returned invalid JSON from {resp.url}: {e}", response=resp)
+
+
+@lru_cache(maxsize=256)
+def graphql_body_prefix(query):
+    """
+    JSON-encode the constant part of a GraphQL request body once per query:
+    b'{"query":"...","variables":' (the variables and closing brace are appended per call).
+    """
+    return orjson.dumps({"query": query})[:-1] + b',"variables":'
+
+
+def shopify_graphql(query, variables=None, timeout=30):
+    """
+    Send one GraphQL request to Shopify and return the parsed response.
+    Throttled requests are retried once the bucket has restored the points they need.
+    Raises requests.exceptions.RequestException on HTTP errors and invalid JSON.
+    """
+    # Only the variables go through the JSON encoder on each call
+    body = graphql_body_prefix(query) + orjson.dumps(variables or {}) + b"}"
+
+    # GraphQL throttling comes back as HTTP 200 with a THROTTLED error,
+    # so the session's Retry (which only looks at status codes) does not see it
+    cost = 0
+    for _ in range(5):
+        resp = shopify_request("POST", SHOPIFY_GQL_URL, GRAPHQL_BUCKET, cost, headers=SHOPIFY_GQL_HEADERS, data=body, timeout=timeout)
+        response_data = parse_shopify_json(resp)
+        GRAPHQL_BUCKET.update_from_graphql(response_data)
+
+        throttled = any(
+            (error.get("extensions") or {}).get("code") == "THROTTLED"
+            for error in response_data.get("errors") or []
+        )
+        if not throttled:
+            break
+        # update_from_graphql has just set the bucket from throttleStatus, so the
+        # next shopify_request sleeps exactly until this query's cost is available
+        cost = ((response_data.get("extensions") or {}).get("cost") or {}).get("requestedQueryCost") or 0
+    return response_data
+
+
+def open_sku_cache():
+    """
+    Open the SQLite file that remembers Shopify SKUs between runs, creating it if needed.
+    Tables from an older SKU_CACHE_VERSION are dropped and created again (empty).
+    """
+    os.makedirs(os.path.dirname(SKU_CACHE_FILE) or ".", exist_ok=True)
+    conn = sqlite3.connect(SKU_CACHE_FILE, timeout=30)
+    if conn.execute("PRAGMA user_version").fetchone()[0] != SKU_CACHE_VERSION:
+        conn.execute("DROP TABLE IF EXISTS shopify_skus")
+        conn.execute("DROP TABLE IF EXISTS cache_info")
+        conn.execute(f"PRAGMA user_version = {SKU_CACHE_VERSION}")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS shopify_skus (
+            variant_id TEXT PRIMARY KEY,
+            sku TEXT,
+            clean_sku TEXT,
+            inventory_item_id TEXT,
+            product_id TEXT,
+            price_cents INTEGER,
+            compare_at_cents INTEGER,
+            stocked INTEGER
+        )
+    """)
+    conn.execute("CREATE TABLE IF NOT EXISTS cache_info (store TEXT, fetched_at REAL)")
+    return conn
+
+
+def load_sku_cache():
+    """
+    Returns the SKUs saved by a previous run, or None if there are none for
+    this store or they are older than SKU_CACHE_HOURS.
+    Quantities are not cached, so on these warm runs current_qty is None and every
+    matched SKU gets a stock update. The cached prices may be hours old; main re-reads
+    the live prices with refresh_prices before changing any of them.
+    """
+    if SKU_CACHE_HOURS <= 0:
+        return None
+
+    try:
+        with closing(open_sku_cache()) as conn:
+            info = conn.execute("SELECT store, fetched_at FROM cache_info").fetchone()
+            if not info or info[0] != SHOPIFY_STORE or info[1] < time.time() - SKU_CACHE_HOURS * 3600:
+                return None
+            rows = conn.execute("""
+                SELECT sku, clean_sku, inventory_item_id, variant_id, product_id, price_cents, compare_at_cents, stocked
+                FROM shopify_skus
+            """).fetchall()
+    except (sqlite3.Error, OSError) as e:
+        print(f"⚠️  Could not read SKU cache: {e}")
+        return None
+
+    # On-hand quantities change with every order, so they are never cached:
+    # current_qty is unknown and the stock is always sent
+    return [
+        {
+            "sku": sku,
+            "clean_sku": clean_sku,
+            "inventory_item_id": inventory_item_id,
+            "variant_id": variant_id,
+            "product_id": product_id,
+            "price_cents": price_cents,
+            "compare_at_cents": compare_at_cents,
+            "current_qty": None,
+            "stocked": bool(stocked)
+        }
+        for sku, clean_sku, inventory_item_id, variant_id, product_id, price_cents, compare_at_cents, stocked in rows
+    ]
+
+
+def save_sku_cache(skus):
+    """Replace the cached SKUs with a freshly fetched list."""
+    if SKU_CACHE_HOURS <= 0:
+        return
+
+    try:
+        with closing(open_sku_cache()) as conn, conn:
+            conn.execute("DELETE FROM shopify_skus")
+            conn.executemany(
+                "INSERT OR REPLACE INTO shopify_skus VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (item["variant_id"], item["sku"], item["clean_sku"], item["inventory_item_id"],
+                     item["product_id"], item["price_cents"], item["compare_at_cents"], item["stocked"])
+                    for item in skus
+                ]
+            )
+            conn.execute("DELETE FROM cache_info")
+            conn.execute("INSERT INTO cache_info VALUES (?, ?)", (SHOPIFY_STORE, time.time()))
+    except (sqlite3.Error, OSError) as e:
+        print(f"⚠️  Could not write SKU cache: {e}")
+
+
+def remember_prices(price_updates):
+    """
+    Store prices we just saved on Shopify in the SKU cache, so the next
+    warm-start run compares against them. `price_updates` is a list of (price_cents, variant_id).
+    """
+    if SKU_CACHE_HOURS <= 0 or not price_updates:
+        return
+
+    try:
+        with closing(open_sku_cache()) as conn, conn:
+            conn.executemany("UPDATE shopify_skus SET price_cents = ? WHERE variant_id = ?", price_updates)
+    except (sqlite3.Error, OSError) as e:
+        print(f"⚠️  Could not update SKU cache: {e}")
+
+
+def get_shopify_skus():
+    """
+    Get all variants with SKUs, prices, and compare_at_prices from Shopify.
+    SKUs saved by a run within the last SKU_CACHE_HOURS are reused without asking Shopify
+    (see load_sku_cache for what that skips).
+    Otherwise uses a Bulk Operation (one query + one file download); if Shopify refuses to
+    run it (e.g. an earlier run's export is still running, Shopify allows one per app and shop)
+    falls back to the REST pagination.
+    Returns (skus, from_cache); skus is None if they could not be fetched.
+    """
+    skus = load_sku_cache()
+    if skus is not None:
+        print(f"✅ Loaded {len(skus)} SKUs from cache (set SKU_CACHE_HOURS=0 to refetch)")
+        return skus, True
+
+    skus = get_shopify_skus_bulk()
+    if skus is None:
+        print("⚠️  Bulk export unavailable, falling back to paginated product fetch...")
+        skus = get_shopify_skus_paginated()
+    if skus:
+        save_sku_cache(skus)
+    return skus, False
+
+
+def get_shopify_skus_bulk():
+    """
+    Export only the fields we need for every variant with bulkOperationRunQuery,
+    wait for Shopify to finish, then stream the JSONL result file.
+    Returns None if the bulk operation could not be run.
+    """
+    # Only the fields the sync needs, one JSONL line per variant
+    # (including the current on-hand quantity at our location)
+    bulk_query = f"""
+    {{
+      productVariants {{
+        edges {{
+          node {{
+            id
+            sku
+            price
+            compareAtPrice
+            product {{ id }}
+            inventoryItem {{
+              id
+              inventoryLevel(locationId: "{LOCATION_GID}") {{
+                quantities(names: ["on_hand"]) {{ quantity }}
+              }}
+            }}
+          }}
+        }}
+      }}
+    }}
+    """
+
+    run_mutation = """
+    mutation bulkOperationRunQuery($query: String!) {
+      bulkOperationRunQuery(query: $query) {
+        bulkOperation { id status }
+        userErrors { field message }
+      }
+    }
+    """
+
+    poll_query = """
+    {
+      currentBulkOperation(type: QUERY) { id status errorCode objectCount url query }
+    }
+    """
+
+    try:
+        print("⏳ Exporting SKUs from Shopify (bulk operation)...")
+        response_data = shopify_graphql(run_mutation, {"query": bulk_query})
+        result = (response_data.get("data") or {}).get("bulkOperationRunQuery") or {}
+        user_errors = result.get("userErrors") or []
+        if user_errors and all("already in progress" in error.get("message", "") for error in user_errors):
+            # Our first attempt timed out and was retried after Shopify had started it: follow that export.
+            # Only if it is running our query, though; an earlier run's export may lack fields we need
+            running = (shopify_graphql(poll_query).get("data") or {}).get("currentBulkOperation") or {}
+            same_query = (running.get("query") or "").split() == bulk_query.split()
+            if same_query and running.get("status") in ("CREATED", "RUNNING"):
+                result = {"bulkOperation": running}
+                user_errors = []
+        if response_data.get("errors") or user_errors or not result.get("bulkOperation"):
+            errors = response_data.get("errors") or user_errors
+            print(f"⚠️  Shopify refused the bulk export: {errors}")
             return None
+        operation_id = result["bulkOperation"]["id"]
+
+        # Wait for Shopify to build the result file
+        while True:
+            time.sleep(BULK_POLL_SECONDS)
+            operation = (shopify_graphql(poll_query).get("data") or {}).get("currentBulkOperation") or {}
+            if operation.get("id") != operation_id:
+                print("⚠️  Bulk export was replaced by another bulk operation.")
+                return None
+            if operation.get("status") == "COMPLETED":
+                break
+            if operation.get("status") in ("FAILED", "CANCELED", "EXPIRED"):
+                print(f"⚠️  Bulk export ended with status {operation['status']} ({operation.get('errorCode')})")
+                return None
+
+        skus = []
+        # No url means the shop has no variants at all
+        if operation.get("url"):
+            # The result file is a signed download link, it must not get our token
+            resp = SESSION.get(operation["url"], stream=True, timeout=60)
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                if not line:
+                    continue
+                variant = orjson.loads(line)
+                inventory_item = variant.get("inventoryItem") or {}
+                # No inventory level means the item is not stocked at our location yet
+                inventory_level = inventory_item.get("inventoryLevel")
+                quantities = (inventory_level or {}).get("quantities") or []
+                if variant.get("sku") and inventory_item.get("id"):
+                    skus.append(make_sku_entry(
+                        variant["sku"],
+                        inventory_item["id"],
+                        variant["id"],
+                        variant["product"]["id"],
+                        variant.get("price", "0.0"),
+                        variant.get("compareAtPrice"),
+                        quantities[0]["quantity"] if quantities else None,
+                        inventory_level is not None
+                    ))
+
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Error exporting SKUs from Shopify: {e}")
+        return None
+    except (ValueError, TypeError, KeyError):
+        print("❌ Could not parse the bulk export from Shopify.")
+        return None
+
+    print(f"✅ Retrieved {len(skus)} SKUs from Shopify")
+    return skus
+
+
+# Pulls the next-page URL out of a header like: <https://...page_info=abc>; rel="next"
+NEXT_LINK_RE = re.compile(r'<([^>]+)>\s*;\s*rel="next"')
+
+
+def get_shopify_skus_paginated():
+    """
+    Get all products with SKUs, prices, and compare_at_prices from Shopify using cursor-based pagination.
+    The next page is already downloading while the current one is being processed.
+    """
+    skus = []
+    url = f"{SHOPIFY_API_URL}/products.json?limit=250"
+
+    # One background worker fetches pages; the rate-limit bucket is still
+    # checked before every request inside shopify_request
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        next_page = prefetcher.submit(shopify_request, "GET", url, REST_BUCKET, timeout=30)
+        while next_page:
+            try:
+                resp = next_page.result()
+
+                next_link = NEXT_LINK_RE.search(resp.headers.get("Link") or "")
+                url = next_link.group(1) if next_link else None
+
+                # Start fetching the next page before parsing this one
+                next_page = prefetcher.submit(shopify_request, "GET", url, REST_BUCKET, timeout=30) if url else None
+
+                products = parse_shopify_json(resp).get("products", [])
+                for product in products:
+                    for variant in product["variants"]:
+                        if variant.get("sku") and variant.get("inventory_item_id"):
+                            # Store GraphQL ids, same as the bulk export returns.
+                            # REST only has the total stock over all locations, so current_qty
+                            # is unknown and the stock is always sent
+                            skus.append(make_sku_entry(
+                                variant["sku"],
+                                f"gid://shopify/InventoryItem/{variant['inventory_item_id']}",
+                                f"gid://shopify/ProductVariant/{variant['id']}",
+                                f"gid://shopify/Product/{product['id']}",
+                                variant.get("price", "0.0"),
+                                variant.get("compare_at_price"),
+                                None
+                            ))
+            except requests.exceptions.RequestException as e:
+                print(f"❌ Error fetching products from Shopify: {e}")
+                return None
     print(f"✅ Retrieved {len(skus)} SKUs from Shopify")
     return skus
 
 
+def load_pos_cache(url):
+    """
+    Returns the cached POS inventory for this URL as a dict with
+    "etag", "last_modified" and "inventory", or None if there is no usable cache.
+    """
+    try:
+        with open(POS_CACHE_FILE, "rb") as f:
+            cached = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return None
+
+    if cached.get("version") != POS_CACHE_VERSION:
+        return None
+    # The URL holds the POS password, so only its hash is stored
+    if cached.get("url_hash") != hashlib.sha256(url.encode()).hexdigest():
+        return None
+    return cached
+
+
+def save_pos_cache(url, resp, pos_inventory):
+    """Store the parsed POS inventory together with the response's ETag/Last-Modified."""
+    etag = resp.headers.get("ETag")
+    last_modified = resp.headers.get("Last-Modified")
+    if not etag and not last_modified:
+        # Nothing to revalidate against, a cache would never be used
+        return
+
+    cached = {
+        "version": POS_CACHE_VERSION,
+        "url_hash": hashlib.sha256(url.encode()).hexdigest(),
+        "etag": etag,
+        "last_modified": last_modified,
+        "inventory": pos_inventory
+    }
+    try:
+        os.makedirs(os.path.dirname(POS_CACHE_FILE) or ".", exist_ok=True)
+        # Write to a temp file first so a crash never leaves a half-written cache
+        tmp_file = POS_CACHE_FILE + ".tmp"
+        with open(tmp_file, "wb") as f:
+            pickle.dump(cached, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, POS_CACHE_FILE)
+    except OSError as e:
+        print(f"⚠️  Could not write POS cache: {e}")
+
+
 def get_all_pos_inventory():
     """
-    Fetches all items from the POS and returns them as a dictionary,
-    safely skipping any malformed items.
+    Fetches all items from the POS, safely skipping any malformed items.
+    Returns parallel NumPy arrays sorted by SKU:
+    {"sku": str array, "quantity": int64 array, "price_cents": int64 array}
+    The response is parsed item by item while it downloads, so the full
+    payload is never held in memory next to the arrays.
+    If the POS says nothing changed since the last run (304), the cached arrays are used.
     """
     print("⏳ Fetching all inventory from POS... (this may take a moment)")
     url = f"{POS_BASE_URL}?ps={POS_PASSWORD}&get=all&output=json&sep=;"
-    pos_inventory_map = {}
+    skus = []
+    quantities = []
+    prices = []
+
+    # Ask the POS to only send the inventory if it changed since the cached copy
+    cached = load_pos_cache(url)
+    headers = {}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
 
     try:
-        resp = requests.get(url, timeout=60)
+        resp = SESSION.get(url, headers=headers, timeout=60, stream=True)
         resp.raise_for_status()
-        pos_data = resp.json()
 
-        for item in pos_data:
+        if resp.status_code == 304 and cached:
+            resp.close()
+            print(f"✅ POS inventory unchanged, loaded {len(cached['inventory']['sku'])} items from cache.")
+            return cached["inventory"]
+
+        # Let urllib3 undo any gzip/deflate before ijson reads the raw stream
+        resp.raw.decode_content = True
+
+        for item in ijson.items(resp.raw, "item"):
             # --- THIS IS THE CRITICAL SAFETY CHECK ---
             # Only process items that have both an ID and a Quantity
             if item and "ID" in item and "Qua" in item and "Price" in item:
-                sku = str(item["ID"])
-                quantity = int(float(item["Qua"]))
-                price = float(item.get("Price", 0))
-                pos_inventory_map[sku] = {
-                    "quantity": quantity,
-                    "price": price
-                }
+                skus.append(str(item["ID"]))
+                quantities.append(int(float(item["Qua"])))
+                # Prices are kept in integer cents from here on
+                prices.append(round(float(item.get("Price", 0)) * 100))
             else:
                 # Optional: Log the bad data if you want to see it
                 # print(f"Skipping malformed item from POS: {item}")
                 pass
 
-        print(f"✅ Loaded {len(pos_inventory_map)} items from POS.")
-        return pos_inventory_map
+        # Sort by SKU so Shopify SKUs can be matched with np.searchsorted
+        pos_skus = np.array(skus, dtype=str)
+        order = np.argsort(pos_skus, kind="stable")
+        pos_skus = pos_skus[order]
+        pos_qty = np.array(quantities, dtype=np.int64)[order]
+        pos_price_cents = np.array(prices, dtype=np.int64)[order]
 
-    except requests.exceptions.RequestException as e:
+        # If a SKU shows up more than once the last one wins
+        last = np.append(pos_skus[1:] != pos_skus[:-1], True) if len(pos_skus) else np.ones(0, dtype=bool)
+        pos_inventory = {
+            "sku": pos_skus[last],
+            "quantity": pos_qty[last],
+            "price_cents": pos_price_cents[last]
+        }
+
+        print(f"✅ Loaded {len(pos_inventory['sku'])} items from POS.")
+        save_pos_cache(url, resp, pos_inventory)
+        return pos_inventory
+
+    except (requests.exceptions.RequestException, Urllib3HTTPError) as e:
+        # Reading resp.raw raises urllib3 errors instead of requests ones
         print(f"❌ Critical error fetching inventory from POS: {e}")
         return None
-    except (ValueError, TypeError):
+    except (ijson.JSONError, ValueError, TypeError):
         print("❌ Critical error: Could not parse JSON data from POS.")
         return None
 
 
-def update_shopify_stock(inventory_item_id, sku, quantity):
+# Live price and compare-at price of a list of variants
+PRICES_QUERY = """
+query livePrices($ids: [ID!]!) {
+  nodes(ids: $ids) {
+    ... on ProductVariant { id price compareAtPrice }
+  }
+}
+"""
+
+
+def refresh_prices(items):
     """
-    Update Shopify stock using the modern GraphQL API.
-    This is more reliable than the old REST endpoint.
+    Re-read the current price and compare_at_price of `items` from Shopify
+    (NODES_PER_REQUEST per request) and update their price_cents/compare_at_cents in place.
+    A variant that no longer exists gets price_cents -1, so its price is left alone.
+    Returns False if the prices could not be read.
     """
-    # The URL for all GraphQL requests is the same
-    url = f"https://{SHOPIFY_STORE}/admin/api/2024-07/graphql.json"
-    headers = {
-        "X-Shopify-Access-Token": SHOPIFY_TOKEN,
-        "Content-Type": "application/json"
-    }
+    for start in range(0, len(items), NODES_PER_REQUEST):
+        chunk = items[start:start + NODES_PER_REQUEST]
+        try:
+            response_data = shopify_graphql(PRICES_QUERY, {"ids": [item["variant_id"] for item in chunk]})
+        except requests.exceptions.RequestException as e:
+            print(f"❌ Error reading current prices from Shopify: {e}")
+            return False
+        if response_data.get("errors"):
+            print(f"❌ Shopify rejected the current price lookup: {response_data['errors']}")
+            return False
 
-    # This is the GraphQL "mutation" (a query that changes data)
-    query = """
-    mutation inventorySetOnHandQuantities($input: InventorySetOnHandQuantitiesInput!) {
-      inventorySetOnHandQuantities(input: $input) {
-        userErrors {
-          field
-          message
-        }
-        inventoryAdjustmentGroup {
-          createdAt
-        }
-      }
+        live = {node["id"]: node for node in (response_data.get("data") or {}).get("nodes") or [] if node}
+        for item in chunk:
+            node = live.get(item["variant_id"]) or {}
+            item["price_cents"] = parse_price_cents(node.get("price"))
+            item["compare_at_cents"] = parse_price_cents(node.get("compareAtPrice"))
+    return True
+
+
+# This is the GraphQL "mutation" (a query that changes data) used for stock updates
+STOCK_QUERY = """
+mutation inventorySetOnHandQuantities($input: InventorySetOnHandQuantitiesInput!) {
+  inventorySetOnHandQuantities(input: $input) {
+    userErrors {
+      field
+      message
+    }
+    inventoryAdjustmentGroup {
+      createdAt
     }
+  }
+}
+"""
+graphql_body_prefix(STOCK_QUERY)  # Encode it now rather than on the first flush
+
+
+def flush_stock_batch(batch, retry=True):
+    """
+    Update Shopify stock for a whole batch of SKUs with ONE GraphQL request.
+    The mutation is all-or-nothing, so if Shopify rejects some entries the
+    batch is sent once more without them.
+    `batch` is a list of {"sku", "inventory_item_id", "quantity"} dicts.
+    Returns the number of SKUs that were synced.
     """
+    if not batch:
+        return 0
 
-    # These are the variables that get passed into the query
+    # These are the variables that get passed into the query (one entry per SKU)
     variables = {
         "input": {
             "reason": "correction",
             "setQuantities": [
                 {
-                    "inventoryItemId": f"gid://shopify/InventoryItem/{inventory_item_id}",
-                    "locationId": f"gid://shopify/Location/{LOCATION_ID}",
-                    "quantity": quantity
+                    "inventoryItemId": entry["inventory_item_id"],
+                    "locationId": LOCATION_GID,
+                    "quantity": entry["quantity"]
                 }
+                for entry in batch
             ]
         }
     }
 
     try:
-        resp = requests.post(url, headers=headers, data=json.dumps({"query": query, "variables": variables}), timeout=15)
-        resp.raise_for_status()
+        response_data = shopify_graphql(STOCK_QUERY, variables)
+        if response_data.get("errors"):
+            print(f"❌ Shopify rejected stock batch of {len(batch)} SKUs: {response_data['errors']}")
+            return 0
 
-        response_data = resp.json()
-        user_errors = response_data.get("data", {}).get("inventorySetOnHandQuantities", {}).get("userErrors", [])
+        result = (response_data.get("data") or {}).get("inventorySetOnHandQuantities") or {}
+        user_errors = result.get("userErrors", [])
 
-        if user_errors:
-            # If there are "userErrors", it means a logical rejection (like the old 422 error)
-            error_message = user_errors[0]['message']
-            print(f"⚠️  Shopify rejected stock update for SKU {sku}. Reason: {error_message}")
-            return False
+        # userErrors point at the offending entry, e.g. ["input", "setQuantities", "3", "quantity"]
+        failed = set()
+        for error in user_errors:
+            index = error_index(error.get("field"), 2)
+            sku = batch[index]["sku"] if index is not None and index < len(batch) else "?"
+            failed.add(index)
+            print(f"⚠️  Shopify rejected stock update for SKU {sku}. Reason: {error['message']}")
+
+        # The mutation is all-or-nothing: no adjustment group means nothing was applied
+        if not result.get("inventoryAdjustmentGroup"):
+            if not user_errors:
+                print(f"⚠️  Shopify did not apply stock batch of {len(batch)} SKUs.")
+                return 0
+            # Send the rest of the batch again so one bad SKU doesn't block the others
+            remaining = [entry for index, entry in enumerate(batch) if index not in failed]
+            if retry and None not in failed and remaining:
+                return flush_stock_batch(remaining, retry=False)
+            return 0
 
-        return True  # Success!
+        synced = 0
+        for index, entry in enumerate(batch):
+            if index not in failed:
+                print(f"✅ Synced stock for SKU {entry['sku']} → Set Qty to {entry['quantity']}")
+                synced += 1
+        return synced
 
     except requests.exceptions.RequestException as e:
-        print(f"❌ Error updating Shopify stock for SKU {sku}: {e}")
-        return False
+        print(f"❌ Error updating Shopify stock for batch of {len(batch)} SKUs: {e}")
+        return 0
 
 
-def update_shopify_price(variant_id, sku, pos_price, current_shopify_price, compare_at_price):
+def flush_price_batch(batch):
     """
-    Update Shopify price using REST API for the variant.
-    Price = POS price + 15%
-    Only updates if:
-    1. Product has no discount (current_price >= compare_at_price OR compare_at_price is null/empty)
-    2. The price needs to be updated (not already increased by 15% from POS price)
+    Update Shopify prices for a whole batch of variants.
+    Variants are grouped per product and every product gets its own aliased
+    productVariantsBulkUpdate field; at most PRICE_PRODUCTS_PER_REQUEST products
+    share one mutation document so the request stays under Shopify's query cost limit.
+    Partial updates are allowed, so one rejected variant doesn't block the rest of its product.
+    `batch` is a list of {"sku", "product_id", "variant_id", "price", "current_price", "pos_price"} dicts.
+    Returns the number of variants that were updated.
     """
-    # Check if product has a discount
-    # A product has a discount if compare_at_price exists and is greater than current_price
-    has_discount = False
-    
-    if compare_at_price and compare_at_price.strip():
-        try:
-            compare_price_float = float(compare_at_price)
-            current_price_float = float(current_shopify_price)
-            
-            # If compare price is higher than current price, there's a discount
-            if compare_price_float > current_price_float:
-                has_discount = True
-                print(f"💰 SKU {sku} has a discount (Compare: {compare_price_float}, Current: {current_price_float}). Skipping price update.")
-                return False
-        except (ValueError, TypeError):
-            # If we can't parse the prices, assume no discount
-            pass
-    
-    # Calculate the target price (POS price + 15%)
-    target_price = round(pos_price * 1.15, 2)
-    
-    # Apply rounding to nearest 5 or 10 Egyptian Pounds
-    target_price = round_to_5_or_10(target_price)
-    
-    # Parse current Shopify price to float
-    try:
-        current_price_float = float(current_shopify_price)
-    except (ValueError, TypeError):
-        print(f"⚠️  Cannot parse current price for SKU {sku}: {current_shopify_price}")
-        return False
-    
-    # Check if current price is already at or above target price (with small tolerance)
-    tolerance = 0.01  # 1 cent tolerance for floating point comparison
-    if abs(current_price_float - target_price) <= tolerance or current_price_float > target_price:
-        print(f"ℹ️  Price for SKU {sku} already at target ({current_price_float}) or higher, skipping price update")
-        return False
-    
-    # Prepare the request
-    url = f"https://{SHOPIFY_STORE}/admin/api/2024-07/variants/{variant_id}.json"
-    headers = {
-        "X-Shopify-Access-Token": SHOPIFY_TOKEN,
-        "Content-Type": "application/json"
-    }
-    
-    data = {
-        "variant": {
-            "id": variant_id,
-            "price": str(target_price)
-        }
-    }
-    
+    if not batch:
+        return 0
+
+    # Group the variants by product (productVariantsBulkUpdate works per product)
+    products = {}
+    for entry in batch:
+        products.setdefault(entry["product_id"], []).append(entry)
+    groups = list(products.items())
+
+    updated = 0
+    for start in range(0, len(groups), PRICE_PRODUCTS_PER_REQUEST):
+        updated += send_price_products(groups[start:start + PRICE_PRODUCTS_PER_REQUEST])
+    return updated
+
+
+def send_price_products(groups):
+    """
+    Send ONE price mutation for a list of (product_id, entries) groups.
+    Returns the number of variants that were updated.
+    """
+    # Build one aliased field per product: p0: productVariantsBulkUpdate(...), p1: ...
+    declarations = []
+    fields = []
+    variables = {}
+    for i, (product_id, entries) in enumerate(groups):
+        declarations.append(f"$product{i}: ID!, $variants{i}: [ProductVariantsBulkInput!]!")
+        fields.append(
+            f"p{i}: productVariantsBulkUpdate(productId: $product{i}, variants: $variants{i}, allowPartialUpdates: true) "
+            "{ productVariants { id } userErrors { field message } }"
+        )
+        variables[f"product{i}"] = product_id
+        variables[f"variants{i}"] = [
+            {"id": entry["variant_id"], "price": str(entry["price"])}
+            for entry in entries
+        ]
+    query = f"mutation productPrices({', '.join(declarations)}) {{\n  " + "\n  ".join(fields) + "\n}"
+    variant_count = sum(len(entries) for _, entries in groups)
+
     try:
-        resp = requests.put(url, headers=headers, data=json.dumps(data), timeout=15)
-        resp.raise_for_status()
-        
-        print(f"💰 Updated price for SKU {sku}: {current_price_float} → {target_price} (+15% from POS price {pos_price})")
-        return True
-        
+        response_data = shopify_graphql(query, variables)
+        if response_data.get("errors"):
+            print(f"❌ Shopify rejected price batch of {variant_count} variants: {response_data['errors']}")
+            return 0
+
+        data = response_data.get("data") or {}
+        saved = []
+        for i, (product_id, entries) in enumerate(groups):
+            result = data.get(f"p{i}") or {}
+
+            # userErrors point at the offending variant, e.g. ["variants", "2", "price"]
+            for error in result.get("userErrors", []):
+                index = error_index(error.get("field"), 1)
+                sku = entries[index]["sku"] if index is not None and index < len(entries) else "?"
+                print(f"❌ Error updating price for SKU {sku}: {error['message']}")
+
+            # Only the variants Shopify returns were actually saved
+            saved_ids = {variant["id"] for variant in result.get("productVariants") or []}
+            for entry in entries:
+                if entry["variant_id"] in saved_ids:
+                    print(f"💰 Updated price for SKU {entry['sku']}: {entry['current_price']} → {entry['price']} (+15% from POS price {entry['pos_price']})")
+                    saved.append((entry["price"] * 100, entry["variant_id"]))
+
+        remember_prices(saved)
+        return len(saved)
+
     except requests.exceptions.RequestException as e:
-        print(f"❌ Error updating price for SKU {sku}: {e}")
-        return False
+        print(f"❌ Error updating prices for batch of {variant_count} variants: {e}")
+        return 0
 
 
 # ==== MAIN ====
@@ -268,40 +949,91 @@ def main():
             print(f"❌ Critical Error: Environment variable '{var}' not found. Please check your .env file.")
             return
 
-    shopify_skus = get_shopify_skus()
+    shopify_skus, skus_from_cache = get_shopify_skus()
     if not shopify_skus:
         print("Could not retrieve SKUs from Shopify. Exiting.")
         return
 
     pos_inventory = get_all_pos_inventory()
-    if not pos_inventory:
+    if pos_inventory is None or not len(pos_inventory["sku"]):
         print("Could not retrieve inventory from POS. Exiting.")
         return
+    pos_skus = pos_inventory["sku"]
+
+    print(f"\nComparing {len(shopify_skus)} Shopify SKUs against {len(pos_skus)} POS items...")
+
+    # Match every Shopify SKU against the sorted POS SKUs in one vectorized step
+    # (SKUs are sanitized once when they are fetched)
+    shopify_clean_skus = np.array([item["clean_sku"] for item in shopify_skus], dtype=str)
+    pos_index = np.minimum(np.searchsorted(pos_skus, shopify_clean_skus), len(pos_skus) - 1)
+    found = pos_skus[pos_index] == shopify_clean_skus
+
+    stock_batch = []
+    matched = []
+    unchanged_stock = 0
+    # Full batches are sent from worker threads while we keep matching SKUs,
+    # the pool size caps how many requests are in flight to Shopify at once
+    executor = ThreadPoolExecutor(max_workers=SHOPIFY_CONCURRENCY)
+    stock_jobs = []
+    price_jobs = []
+
+    for i in np.flatnonzero(~found):
+        print(f"❌ No match in POS for SKU: {shopify_skus[i]['sku']}")
 
-    print(f"\nComparing {len(shopify_skus)} Shopify SKUs against {len(pos_inventory)} POS items...")
-
-    for item in shopify_skus:
-        original_sku = item["sku"]
-        inventory_item_id = item["inventory_item_id"]
-        variant_id = item["variant_id"]
-        current_shopify_price = item["current_price"]
-        compare_at_price = item["compare_at_price"]
-
-        clean_sku = sanitize_sku(original_sku)
-        pos_data = pos_inventory.get(clean_sku)
-
-        if pos_data is not None:
-            # Update stock
-            if update_shopify_stock(inventory_item_id, original_sku, pos_data["quantity"]):
-                print(f"✅ Synced stock for SKU {original_sku} → Set Qty to {pos_data['quantity']}")
-            
-            # Update price (with discount check)
-            time.sleep(0.2)  # Sleep between requests
-            update_shopify_price(variant_id, original_sku, pos_data["price"], current_shopify_price, compare_at_price)
+    matched_index = pos_index[found]
+    for item_index, pos_i in zip(np.flatnonzero(found), matched_index):
+        item = shopify_skus[item_index]
+        quantity = int(pos_inventory["quantity"][pos_i])
+
+        # Queue stock update, unless Shopify already has the POS quantity.
+        # Items not stocked at our location would only make Shopify reject the whole batch
+        if not item["stocked"]:
+            print(f"⚠️  SKU {item['sku']} is not stocked at the Shopify location, skipping stock update")
+        elif quantity == item["current_qty"]:
+            unchanged_stock += 1
+        else:
+            stock_batch.append({
+                "sku": item["sku"],
+                "inventory_item_id": item["inventory_item_id"],
+                "quantity": quantity
+            })
+        # Prices are decided for all matched SKUs at once below
+        matched.append(item)
+
+        # Send full batches as soon as they fill up
+        if len(stock_batch) >= BATCH_SIZE:
+            stock_jobs.append(executor.submit(flush_stock_batch, stock_batch))
+            stock_batch = []
+
+    # Send whatever is left over
+    stock_jobs.append(executor.submit(flush_stock_batch, stock_batch))
+    if unchanged_stock:
+        print(f"ℹ️  {unchanged_stock} SKUs already have the POS quantity, skipping stock update")
+
+    # Update price (with discount check)
+    pos_price_cents = pos_inventory["price_cents"][matched_index]
+    price_updates = get_price_updates(matched, pos_price_cents)
+    if price_updates and skus_from_cache:
+        # Prices from the SKU cache can be hours old: re-read the live price of every variant
+        # we are about to change, so a sale started in the admin since then is not overwritten
+        changing = {update["variant_id"] for update in price_updates}
+        if refresh_prices([item for item in matched if item["variant_id"] in changing]):
+            price_updates = get_price_updates(matched, pos_price_cents)
         else:
-            print(f"❌ No match in POS for SKU: {original_sku}")
+            print("⚠️  Could not confirm current prices, skipping price updates this run")
+            price_updates = []
+    skipped = len(matched) - len(price_updates)
+    if skipped:
+        print(f"ℹ️  {skipped} prices already at target, discounted or unknown, skipping price update")
+    for start in range(0, len(price_updates), BATCH_SIZE):
+        price_jobs.append(executor.submit(flush_price_batch, price_updates[start:start + BATCH_SIZE]))
+
+    # Wait for every batch to finish
+    executor.shutdown(wait=True)
 
-        time.sleep(0.2)  # Sleep between products to avoid rate limiting
+    synced = sum(job.result() for job in stock_jobs)
+    updated = sum(job.result() for job in price_jobs)
+    print(f"\n✅ Done: synced stock for {synced} SKUs, updated {updated} prices.")
 
 
 if __name__ == "__main__":